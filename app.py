@@ -1,8 +1,10 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+from dataclasses import dataclass, field
 from datetime import timedelta
-from transformers import pipeline
-import time
+import re
+import unicodedata
 
 
 if "app_initialized" not in st.session_state:
@@ -22,6 +24,9 @@ NEGOTIATION_GUARDRAILS = {
 # =========================
 st.set_page_config("Zero-Touch Renewals", layout="wide")
 
+# One "today" per script run, shared by quote building and rendering
+TODAY = pd.Timestamp.today().normalize()
+
 # =========================
 # SESSION STATE
 # =========================
@@ -29,8 +34,14 @@ for k, v in {
     "page": "dashboard",
     "selected_asset": None,
     "agent_df": None,
-    "expanded_rows": set(),
+    "agent_df_version": 0,
+    "asset_pos": {},
+    "filtered_view": None,
+    "worklist_gen": 0,
+    "card_html": {},
     "quotes": {},
+    "quotes_by_asset": {},
+    "llm_explanations": {},
     "current_quote_id": None,
     "accept_count": 0,
     "reject_count": 0,
@@ -73,38 +84,46 @@ st.sidebar.divider()
 # =========================
 st.sidebar.header("Filters")
 
+# Fixed category sets shared by the sidebar options and the load_assets dtypes, so .isin compares int codes
+CUSTOMER_TYPE_DTYPE = pd.CategoricalDtype(["Enterprise", "SMB"])
+PRODUCT_DTYPE = pd.CategoricalDtype(["Servers", "Storage", "Networking", "Software"])
+COUNTRY_DTYPE = pd.CategoricalDtype(["US", "India", "Germany"])
+REGION_DTYPE = pd.CategoricalDtype(["North America", "APAC", "EMEA"])
+# Ordered so priority sorts/compares on integer codes
+PRIORITY_DTYPE = pd.CategoricalDtype(["Low", "Medium", "High"], ordered=True)
+
 customer_types_filter = st.sidebar.multiselect(
     "Customer Type",
-    options=["Enterprise", "SMB"],
-    default=["Enterprise", "SMB"],
+    options=list(CUSTOMER_TYPE_DTYPE.categories),
+    default=list(CUSTOMER_TYPE_DTYPE.categories),
     key="filter_customer_type"
 )
 
 product_filter = st.sidebar.multiselect(
     "Product",
-    options=["Servers", "Storage", "Networking", "Software"],
-    default=["Servers", "Storage", "Networking", "Software"],
+    options=list(PRODUCT_DTYPE.categories),
+    default=list(PRODUCT_DTYPE.categories),
     key="filter_product"
 )
 
 country_filter = st.sidebar.multiselect(
     "Country",
-    options=["US", "India", "Germany"],
-    default=["US", "India", "Germany"],
+    options=list(COUNTRY_DTYPE.categories),
+    default=list(COUNTRY_DTYPE.categories),
     key="filter_country"
 )
 
 region_filter = st.sidebar.multiselect(
     "Region",
-    options=["North America", "APAC", "EMEA"],
-    default=["North America", "APAC", "EMEA"],
+    options=list(REGION_DTYPE.categories),
+    default=list(REGION_DTYPE.categories),
     key="filter_region"
 )
 
 priority_filter = st.sidebar.multiselect(
     "Priority",
-    options=["High", "Medium", "Low"],
-    default=["High", "Medium", "Low"],
+    options=list(PRIORITY_DTYPE.categories[::-1]),
+    default=list(PRIORITY_DTYPE.categories[::-1]),
     key="filter_priority"
 )
 
@@ -133,11 +152,14 @@ def money(x): return f"${float(x):,.0f}"
 def money_m(x): return f"${float(x)/1_000_000:.1f}M"
 def pct(x): return f"{int(x)}%"
 
+PRIORITY_BADGES = {"High": "🔴 High", "Medium": "🟡 Medium", "Low": "🟢 Low"}
+STATUS_BADGES = {"Act Now": "⚡ Act Now", "Good to Act": "✅ Good to Act", "Monitor": "⏸️ Monitor", "On Hold": "⏸️ On Hold"}
+
 def priority_badge(p):
-    return {"High": "🔴 High", "Medium": "🟡 Medium", "Low": "🟢 Low"}.get(p, p)
+    return PRIORITY_BADGES.get(p, p)
 
 def status_badge(s):
-    return {"Act Now": "⚡ Act Now", "Good to Act": "✅ Good to Act", "Monitor": "⏸️ Monitor", "On Hold": "⏸️ On Hold"}.get(s, s)
+    return STATUS_BADGES.get(s, s)
 
 def p2c_badge(score: int) -> str:
     if score >= 70:
@@ -149,395 +171,437 @@ def p2c_badge(score: int) -> str:
 # =========================
 # LLM (LAZY LOAD)
 # =========================
+LLM_MODEL = "google/flan-t5-base"
+LLM_STREAM_TIMEOUT = 60  # seconds to wait for the next streamed chunk before giving up
+
 @st.cache_resource
-def load_llm():
+def load_llm(model_name: str = LLM_MODEL):
     # Safe local model. (If model not available, app will gracefully fallback.)
+    # Imported here so rule-based sessions never pay for loading torch/transformers.
+    import torch
+    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, pipeline
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+    if torch.cuda.is_available():
+        # Half-precision weights on GPU; bf16 where supported since T5 can overflow in fp16
+        model = model.to(torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16)
+        device = 0
+    else:
+        # int8 dynamic quantization of the Linear layers: ~4x smaller and faster on CPU.
+        # torch.ao.quantization is deprecated from torch 2.14; requirements.txt pins a range that still ships it.
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        device = -1
     return pipeline(
         "text2text-generation",
-        model="google/flan-t5-large",
+        model=model,
+        tokenizer=tokenizer,
+        device=device,
         max_length=120,
+        truncation=True,
+    )
+
+def explain_signature(row) -> tuple:
+    # The prioritization rule predicates (run_agents thresholds): rows that agree on priority and
+    # every predicate share one explanation (and one model call), and never differ on a rule reason
+    days = int(row["days_to_expiry"])
+    return (
+        str(row["opportunity_priority"]),
+        days <= 30,
+        days <= 90,
+        int(row["usage_decline_pct"]) >= 40,
+        float(row["contract_value"]) > 25000,
+        int(row["usage_pct"]) >= 80,
+        float(row["asset_age_years"]) >= 3,
+    )
+
+def explain_prompt(signature: tuple) -> str:
+    # Built from the signature, not the raw row, so a cached explanation is true for every row sharing it
+    priority, within_30, within_90, declining, high_value, high_usage, aged = signature
+    days = "30 or fewer" if within_30 else "31-90" if within_90 else "over 90"
+    return (
+        f"Explain in 1-2 short bullet points why this renewal opportunity was assigned {priority} priority.\n"
+        f"Days to expiry: {days}\n"
+        f"Usage decline: {'40% or more' if declining else 'under 40%'}\n"
+        f"Contract value: {'over $25,000' if high_value else '$25,000 or less'}\n"
+        f"Usage: {'80% or more' if high_usage else 'under 80%'}\n"
+        f"Asset age: {'3+ years' if aged else 'under 3 years'}\n"
+        "Return max 2 bullets."
     )
 
-def llm_explain(row):
+def llm_explain_stream(prompt: str, model_name: str = LLM_MODEL, timeout: float = LLM_STREAM_TIMEOUT):
+    # Yields text as the model decodes it; generate() runs on a worker thread feeding the streamer.
+    # Worker errors and stalls are re-raised here, so callers can fall back instead of hanging.
+    from queue import Empty
+    from threading import Thread
+    from transformers import TextIteratorStreamer
+
+    llm = load_llm(model_name)
+    streamer = TextIteratorStreamer(llm.tokenizer, skip_special_tokens=True, timeout=timeout)
+    inputs = llm.tokenizer(prompt, return_tensors="pt", truncation=True).to(llm.model.device)
+    errors = []
+
+    def generate():
+        try:
+            llm.model.generate(**inputs, max_new_tokens=120, streamer=streamer)
+        except Exception as exc:
+            errors.append(exc)
+            streamer.end()  # unblock the consumer; generate() never reached its own end()
+
+    Thread(target=generate, daemon=True).start()
     try:
-        llm = load_llm()
-        prompt = (
-            "Explain in 1-2 short bullet points why this renewal opportunity priority was assigned.\n"
-            f"Days to expiry: {row['days_to_expiry']}\n"
-            f"Usage %: {row['usage_pct']}\n"
-            f"Usage decline %: {row['usage_decline_pct']}\n"
-            f"Contract value: {row['contract_value']}\n"
-            f"Asset age: {row['asset_age_years']}\n"
-            "Return max 2 bullets."
-        )
-        return llm(prompt)[0]["generated_text"]
+        yield from streamer
+    except Empty:
+        raise TimeoutError(f"LLM stream produced nothing for {timeout}s") from None
+    if errors:
+        raise errors[0]
+
+def render_explanation(row):
+    # Generated on demand for the asset being viewed, so the dashboard never waits on the model.
+    # Finished text is kept per rule signature for the session; failures are not stored and retry next time.
+    if not use_llm:
+        st.write("Rule-based decision. Enable LLM for explanation.")
+        return
+
+    signature = explain_signature(row)
+    cached = st.session_state.llm_explanations.get(signature)
+    if cached is not None:
+        st.write(cached)
+        return
+
+    try:
+        st.session_state.llm_explanations[signature] = st.write_stream(llm_explain_stream(explain_prompt(signature)))
     except Exception:
-        return "Rule-based decision (LLM unavailable)"
+        st.write("Rule-based decision (LLM unavailable)")
+
+# Free-text reasons make the key space open-ended, so the cache is bounded
+@st.cache_data(show_spinner=False, max_entries=4096)
+def llm_classify(prompt: str, choices: tuple[str, ...], model_name: str = LLM_MODEL) -> str:
+    # Decode only tokens that spell one of `choices`, then stop (a few tokens instead of 120)
+    llm = load_llm(model_name)
+    tokenizer = llm.tokenizer
+    choice_ids = [tokenizer(c, add_special_tokens=False).input_ids for c in choices]
+
+    def allowed_tokens(batch_id, input_ids):
+        generated = input_ids.tolist()[1:]  # drop the decoder start token
+        n = len(generated)
+        allowed = {ids[n] for ids in choice_ids if len(ids) > n and ids[:n] == generated}
+        if generated in choice_ids or not allowed:
+            allowed.add(tokenizer.eos_token_id)
+        return list(allowed)
+
+    out = llm(
+        prompt,
+        max_new_tokens=max(len(ids) for ids in choice_ids) + 1,
+        do_sample=False,
+        num_beams=1,
+        prefix_allowed_tokens_fn=allowed_tokens,
+    )
+    return out[0]["generated_text"].strip()
+
+NEGOTIATION_INTENTS = {"price": "price", "hardware": "hardware_change", "timing": "timing", "unclear": "unclear"}
+
+def normalize_reason(reason_text: str) -> str:
+    # Cache key only. Case, punctuation, symbols and spacing carry no intent, so near-duplicates
+    # ("Price too high!" / "price too high") share an entry; letters and combining marks of any script are kept
+    folded = "".join(" " if unicodedata.category(c)[0] in "PSZC" else c for c in reason_text.casefold())
+    return " ".join(folded.split())
+
+@st.cache_data(show_spinner=False, max_entries=4096)
+def _negotiation_intent(reason_key: str, _reason_text: str) -> str:
+    # Cached on the normalized key (underscore args are not hashed); the model sees the customer's own wording
+    prompt = (
+        "Classify the customer's intent based on rejection reason.\n"
+        "Return ONE of: price, hardware, timing, unclear.\n\n"
+        f"Reason: {_reason_text}"
+    )
+    result = llm_classify(prompt, tuple(NEGOTIATION_INTENTS))
+    return NEGOTIATION_INTENTS.get(result, "unclear")
 
 def llm_negotiate(reason_text: str):
     try:
-        llm = load_llm()
-        prompt = (
-            "Classify the customer's intent based on rejection reason.\n"
-            "Return ONE of: price, hardware_change, timing, unclear.\n\n"
-            f"Reason: {reason_text}"
-        )
-        result = llm(prompt)[0]["generated_text"].lower()
-        if "price" in result:
-            return "price"
-        if "hardware" in result or "replace" in result or "refresh" in result:
-            return "hardware_change"
-        if "later" in result or "budget" in result or "next" in result:
-            return "timing"
-        return "unclear"
+        return _negotiation_intent(normalize_reason(reason_text), reason_text)
     except Exception:
         return "unclear"
 
 # =========================
 # SAMPLE DATA
 # =========================
-def load_assets():
-    today = pd.Timestamp.today()
-    data = [
-        {
-            "asset_id": "A-10001",
-            "customer": "ABC Bank",
-            "customer_type": "Enterprise",
-            "product": "Servers",
-            "contract_value": 42000,
-            "contract_start": today - timedelta(days=900),
-            "contract_end": today + timedelta(days=15),
-            "usage_pct": 90,
-            "usage_decline_pct": 2,
-            "asset_age_years": 4.2,
-            "last_discount_pct": 10,
-            "licensing": "Per-core",
-            "country": "US",
-            "region": "North America",
-
-        },
-        {
-            "asset_id": "A-10002",
-            "customer": "Delta Inc",
-            "customer_type": "SMB",
-            "product": "Storage",
-            "contract_value": 18000,
-            "contract_start": today - timedelta(days=700),
-            "contract_end": today + timedelta(days=25),
-            "usage_pct": 30,
-            "usage_decline_pct": 55,
-            "asset_age_years": 2.1,
-            "last_discount_pct": 25,  # guardrail breach for High
-            "licensing": "Capacity",
-            "country": "US",
-            "region": "North America",
-
-        },
-        {
-            "asset_id": "A-10003",
-            "customer": "Zento Pvt Ltd",
-            "customer_type": "Enterprise",
-            "product": "Networking",
-            "contract_value": 68000,
-            "contract_start": today - timedelta(days=1200),
-            "contract_end": today + timedelta(days=75),
-            "usage_pct": 85,
-            "usage_decline_pct": 10,
-            "asset_age_years": 5.1,
-            "last_discount_pct": 12,
-            "licensing": "Enterprise",
-            "country": "US",
-            "region": "North America",
-
-        },
-        {
-            "asset_id": "A-10004",
-            "customer": "Nimbus Labs",
-            "customer_type": "SMB",
-            "product": "Software",
-            "contract_value": 9000,
-            "contract_start": today - timedelta(days=400),
-            "contract_end": today + timedelta(days=180),
-            "usage_pct": 92,
-            "usage_decline_pct": 0,
-            "asset_age_years": 1.0,
-            "last_discount_pct": 3,
-            "licensing": "User-based",
-            "country": "US",
-            "region": "North America",
-
-        },
-        {
-            "asset_id": "A-10005",
-            "customer": "Orion Systems",
-            "customer_type": "Enterprise",
-            "product": "Storage",
-            "contract_value": 32000,
-            "contract_start": today - timedelta(days=800),
-            "contract_end": today + timedelta(days=60),
-            "usage_pct": 78,
-            "usage_decline_pct": 15,
-            "asset_age_years": 3.8,
-            "last_discount_pct": 20,  # guardrail breach for Medium
-            "licensing": "Capacity",
-            "country": "US",
-            "region": "North America",
-
-        },
-        {
-            "asset_id": "A-10006",
-            "customer": "Or Systems",
-            "customer_type": "Enterprise",
-            "product": "Storage",
-            "contract_value": 32000,
-            "contract_start": today - timedelta(days=800),
-            "contract_end": today + timedelta(days=60),
-            "usage_pct": 78,
-            "usage_decline_pct": 15,
-            "asset_age_years": 3.8,
-            "last_discount_pct": 20,  # guardrail breach for Medium
-            "licensing": "Capacity",
-            "country": "US",
-            "region": "North America",
-
-        },
-        {
-            "asset_id": "A-10007",
-            "customer": "Ion Systems",
-            "customer_type": "Enterprise",
-            "product": "Storage",
-            "contract_value": 32000,
-            "contract_start": today - timedelta(days=800),
-            "contract_end": today + timedelta(days=60),
-            "usage_pct": 78,
-            "usage_decline_pct": 15,
-            "asset_age_years": 3.8,
-            "last_discount_pct": 20,  # guardrail breach for Medium
-            "licensing": "Capacity",
-            "country": "US",
-            "region": "North America",
-
-        },
-        {
-            "asset_id": "A-10008",
-            "customer": "Orion Bank",
-            "customer_type": "Enterprise",
-            "product": "Storage",
-            "contract_value": 32000,
-            "contract_start": today - timedelta(days=800),
-            "contract_end": today + timedelta(days=60),
-            "usage_pct": 78,
-            "usage_decline_pct": 15,
-            "asset_age_years": 3.8,
-            "last_discount_pct": 20,  # guardrail breach for Medium
-            "licensing": "Capacity",
-            "country": "US",
-            "region": "North America",
-
-        },
-        {
-            "asset_id": "A-10009",
-            "customer": "AL Systems",
-            "customer_type": "Enterprise",
-            "product": "Storage",
-            "contract_value": 32000,
-            "contract_start": today - timedelta(days=800),
-            "contract_end": today + timedelta(days=60),
-            "usage_pct": 78,
-            "usage_decline_pct": 15,
-            "asset_age_years": 3.8,
-            "last_discount_pct": 20,  # guardrail breach for Medium
-            "licensing": "Capacity",
-            "country": "US",
-            "region": "North America",
-
-        },
-        {
-            "asset_id": "A-10010",
-            "customer": "BL Systems",
-            "customer_type": "Enterprise",
-            "product": "Storage",
-            "contract_value": 32000,
-            "contract_start": today - timedelta(days=800),
-            "contract_end": today + timedelta(days=60),
-            "usage_pct": 78,
-            "usage_decline_pct": 15,
-            "asset_age_years": 3.8,
-            "last_discount_pct": 20,  # guardrail breach for Medium
-            "licensing": "Capacity",
-            "country": "US",
-            "region": "North America",
-
-        },
-        {
-            "asset_id": "A-10011",
-            "customer": "TL Systems",
-            "customer_type": "Enterprise",
-            "product": "Storage",
-            "contract_value": 32000,
-            "contract_start": today - timedelta(days=800),
-            "contract_end": today + timedelta(days=60),
-            "usage_pct": 78,
-            "usage_decline_pct": 15,
-            "asset_age_years": 3.8,
-            "last_discount_pct": 20,  # guardrail breach for Medium
-            "licensing": "Capacity",
-            "country": "US",
-            "region": "North America",
-
-        },{
-            "asset_id": "A-10012",
-            "customer": "Renewal Inc",
-            "customer_type": "SMB",
-            "product": "Storage",
-            "contract_value": 18000,
-            "contract_start": today - timedelta(days=700),
-            "contract_end": today + timedelta(days=25),
-            "usage_pct": 30,
-            "usage_decline_pct": 55,
-            "asset_age_years": 2.1,
-            "last_discount_pct": 30,  # guardrail breach for High
-            "licensing": "Capacity",
-            "country": "US",
-            "region": "North America",
-
-        },
-    ]
+@st.cache_data(ttl=3600)
+def load_assets(today: pd.Timestamp):
+    # `today` is the normalized date, so the cache key only changes once a day
+    # Column-wise (one array per field), matching pandas' own column store; narrow dtypes where values allow
+    data = {
+        "asset_id": [
+            "A-10001", "A-10002", "A-10003", "A-10004", "A-10005", "A-10006",
+            "A-10007", "A-10008", "A-10009", "A-10010", "A-10011", "A-10012",
+        ],
+        "customer": [
+            "ABC Bank", "Delta Inc", "Zento Pvt Ltd", "Nimbus Labs", "Orion Systems", "Or Systems",
+            "Ion Systems", "Orion Bank", "AL Systems", "BL Systems", "TL Systems", "Renewal Inc",
+        ],
+        "customer_type": [
+            "Enterprise", "SMB", "Enterprise", "SMB", "Enterprise", "Enterprise",
+            "Enterprise", "Enterprise", "Enterprise", "Enterprise", "Enterprise", "SMB",
+        ],
+        "product": [
+            "Servers", "Storage", "Networking", "Software", "Storage", "Storage",
+            "Storage", "Storage", "Storage", "Storage", "Storage", "Storage",
+        ],
+        "contract_value": np.array(
+            [42000, 18000, 68000, 9000, 32000, 32000, 32000, 32000, 32000, 32000, 32000, 18000], dtype=np.int32
+        ),
+        "contract_start": today - pd.to_timedelta(
+            np.array([900, 700, 1200, 400, 800, 800, 800, 800, 800, 800, 800, 700], dtype=np.int16), unit="D"
+        ),
+        "contract_end": today + pd.to_timedelta(
+            np.array([15, 25, 75, 180, 60, 60, 60, 60, 60, 60, 60, 25], dtype=np.int16), unit="D"
+        ),
+        "usage_pct": np.array([90, 30, 85, 92, 78, 78, 78, 78, 78, 78, 78, 30], dtype=np.int8),
+        "usage_decline_pct": np.array([2, 55, 10, 0, 15, 15, 15, 15, 15, 15, 15, 55], dtype=np.int8),
+        "asset_age_years": np.array([4.2, 2.1, 5.1, 1.0, 3.8, 3.8, 3.8, 3.8, 3.8, 3.8, 3.8, 2.1]),
+        # A-10002/A-10012 breach the High guardrail, A-10005..A-10011 the Medium one
+        "last_discount_pct": np.array([10, 25, 12, 3, 20, 20, 20, 20, 20, 20, 20, 30], dtype=np.int8),
+        "licensing": [
+            "Per-core", "Capacity", "Enterprise", "User-based", "Capacity", "Capacity",
+            "Capacity", "Capacity", "Capacity", "Capacity", "Capacity", "Capacity",
+        ],
+        "country": ["US"] * 12,
+        "region": ["North America"] * 12,
+    }
     df = pd.DataFrame(data)
-    df["days_to_expiry"] = (df["contract_end"] - today).dt.days
-    return df
+    # Plain integer day arithmetic on the datetime64 buffer instead of the Timedelta accessor; int16 covers ±89 years
+    df["days_to_expiry"] = (
+        df["contract_end"].to_numpy().astype("datetime64[D]") - today.to_datetime64().astype("datetime64[D]")
+    ).astype("int16")
+    # Display dates derived once here instead of re-parsed on every render
+    df["contract_start_date"] = df["contract_start"].dt.date
+    df["contract_end_date"] = df["contract_end"].dt.date
+    return df.astype({
+        "customer_type": CUSTOMER_TYPE_DTYPE,
+        "product": PRODUCT_DTYPE,
+        "country": COUNTRY_DTYPE,
+        "region": REGION_DTYPE,
+        "licensing": "category",
+    })
 
 # =========================
 # AGENTS
 # =========================
-def run_agents(df: pd.DataFrame, use_llm_flag: bool) -> pd.DataFrame:
-    rows = []
-    for _, r in df.iterrows():
-        if r["days_to_expiry"] <= 30 or r["usage_decline_pct"] >= 40:
-            priority, status = "High", "Act Now"
-        elif r["contract_value"] > 25000 or r["days_to_expiry"] <= 90:
-            priority, status = "Medium", "Good to Act"
-        else:
-            priority, status = "Low", "Monitor"
-
-        expansion = (
-            "Upsell" if r["usage_pct"] >= 80
-            else "Cross-sell" if r["asset_age_years"] >= 3
-            else "Renewal Only"
-        )
+# Per-priority lookups, indexed by PRIORITY_DTYPE code (Low, Medium, High)
+DISCOUNT_BY_PRIORITY = np.array([0.02, 0.07, 0.15])
+P2C_BY_PRIORITY = np.array([30, 55, 75], dtype=np.int8)  # simple P2C for MVP
+
+def calculate_probability_to_close(df: pd.DataFrame) -> pd.Series:
+    # One gather over the int8 category codes: a single fused pass, no per-row Python or np.where temporaries
+    codes = df["opportunity_priority"].astype(PRIORITY_DTYPE).cat.codes.to_numpy()
+    return pd.Series(P2C_BY_PRIORITY[codes], index=df.index, name="probability_to_close")
+
+def run_agents(df: pd.DataFrame) -> pd.DataFrame:
+    days = df["days_to_expiry"].to_numpy()
+    cv = df["contract_value"].to_numpy()
+
+    is_high = (days <= 30) | (df["usage_decline_pct"].to_numpy() >= 40)
+    is_medium = (cv > 25000) | (days <= 90)
+    priority = pd.Categorical(
+        np.select([is_high, is_medium], ["High", "Medium"], default="Low"), dtype=PRIORITY_DTYPE
+    )
+    status = np.select([is_high, is_medium], ["Act Now", "Good to Act"], default="Monitor")
 
-        discount_map = {"High": 0.15, "Medium": 0.07, "Low": 0.02}
-        expected_revenue = r["contract_value"] * (1 - discount_map[priority])
+    expansion = np.select(
+        [df["usage_pct"].to_numpy() >= 80, df["asset_age_years"].to_numpy() >= 3],
+        ["Upsell", "Cross-sell"],
+        default="Renewal Only",
+    )
 
-        # simple P2C for MVP
-        p2c = 75 if priority == "High" else 55 if priority == "Medium" else 30
+    expected_revenue = (cv * (1 - DISCOUNT_BY_PRIORITY[priority.codes])).round()
 
-        rows.append({
-            **r,
-            "opportunity_priority": priority,
-            "opportunity_status": status,
-            "upsell_cross_sell": expansion,
-            "expected_revenue_impact": round(expected_revenue, 0),
-            "probability_to_close": p2c,
-            "llm_explanation": llm_explain(r) if use_llm_flag else "Rule-based decision",
-        })
+    out = df.assign(
+        opportunity_priority=priority,
+        opportunity_status=pd.Categorical(status),
+        upsell_cross_sell=pd.Categorical(expansion),
+        expected_revenue_impact=expected_revenue,
+    )
+    out["probability_to_close"] = calculate_probability_to_close(out)
+
+    # Worklist badge columns + action button label/key, built once per scoring run; filter reruns only slice them.
+    # P2C and impact stay numeric (formatted by column_config) so the table sorts them by value.
+    return out.assign(
+        _prio_badge=priority.rename_categories(PRIORITY_BADGES),
+        _status_badge=out["opportunity_status"].cat.rename_categories(STATUS_BADGES),
+        _action_label=np.where(priority == "Low", "Review", "Generate Quote"),
+        _quote_key="quote_" + out["asset_id"],
+    )
 
-    return pd.DataFrame(rows)
+@st.cache_data(show_spinner=False)
+def run_agents_cached(df: pd.DataFrame) -> pd.DataFrame:
+    # Sidebar/filter reruns reuse the scored frame; only "Run Agents" with new inputs recomputes
+    return run_agents(df)
 
 # =========================
 # QUOTES + GUARDRAILS
 # =========================
+@dataclass(slots=True)
+class DiscountChange:
+    previous: float | None
+    current: float
+
+@dataclass(slots=True)
+class Pricing:
+    skus: tuple[tuple[str, str, float], ...]
+    skus_md: str  # SKU table pre-rendered as Markdown at build time
+    subtotal: float
+    discount_pct: float
+    discount_amt: float
+    discount_reason: str
+    discount_source: str
+    total: float
+    discount_change: DiscountChange
+
+@dataclass(slots=True)
+class Contract:
+    start: pd.Timestamp
+    end: pd.Timestamp
+    service_level: str
+
+@dataclass(slots=True)
+class Decision:
+    decision: str
+    reason: str
+    timestamp: pd.Timestamp
+
+@dataclass(slots=True)
+class Approval:
+    required: bool = False
+    approved: bool = False
+    approved_at: pd.Timestamp | None = None
+
+@dataclass(slots=True)
+class Quote:
+    quote_id: str
+    version: int
+    parent_quote_id: str | None
+    asset_id: str
+    customer: str
+    created_at: pd.Timestamp
+    created_at_str: str  # formatted once at build time for the history timeline
+    pricing: Pricing
+    contract: Contract
+    status: str = "PENDING"
+    decision: Decision | None = None
+    approval: Approval = field(default_factory=Approval)
+
 def check_discount_guardrail(priority: str, discount_pct: float) -> bool:
     max_allowed = NEGOTIATION_GUARDRAILS.get(priority, {}).get("max_discount", 0)
     return float(discount_pct) > float(max_allowed)
 
+def price_quote(contract_value: float, expansion_type: str, discount_pct: float):
+    # Pure pricing from plain values; build_quote wraps the result in a fresh Quote
+    base_price = float(contract_value)
+    add_on_price = 5000.0 if expansion_type in ["Upsell", "Cross-sell"] else 0.0
+
+    # (sku, item, price) rows; the SKU set is fixed, so the subtotal is plain arithmetic
+    if expansion_type == "Upsell":
+        skus = (("SUP-PSP-PLUS", "ProSupport Plus", base_price),)
+    else:
+        skus = (("SUP-PSP", "ProSupport", base_price),)
+
+    if add_on_price > 0:
+        skus += (("ANL-ADV-02", "Advanced Analytics", add_on_price),)
+
+    subtotal = base_price + add_on_price
+    discount_amt = round(subtotal * discount_pct / 100.0, 2)
+    total = round(subtotal - discount_amt, 2)
+
+    # --- Service level logic (explicit & safe) ---
+    service_level = "ProSupport Plus" if expansion_type == "Upsell" else "ProSupport"
+
+    # Rendered once per quote, so the quote page shows it without building a DataFrame
+    skus_md = "| sku | item | price |\n|---|---|---:|\n" + "\n".join(
+        f"| {sku} | {item} | {price:,.2f} |" for sku, item, price in skus
+    )
+
+    return skus, skus_md, subtotal, discount_amt, total, service_level
+
 def build_quote(
     asset_row,
     version=1,
     parent_quote_id=None,
     discount_reason="Initial system generated discount",
     discount_source="rules_engine",
-    previous_discount=None
+    previous_discount=None,
+    today=None,
 ):
+    today = pd.Timestamp.today().normalize() if today is None else today
 
     quote_id = f"{asset_row['asset_id']}-v{version}"
 
-    base_price = float(asset_row["contract_value"])
-    add_on_price = 5000.0 if asset_row["upsell_cross_sell"] in ["Upsell", "Cross-sell"] else 0.0
-
-    expansion_type = asset_row.get("upsell_cross_sell", "Renewal Only")
-
-    if expansion_type == "Upsell":
-        skus = [{
-            "sku": "SUP-PSP-PLUS",
-            "item": "ProSupport Plus",
-            "price": base_price
-        }]
-    else:
-        skus = [{
-            "sku": "SUP-PSP",
-            "item": "ProSupport",
-            "price": base_price
-        }]
-
-    if add_on_price > 0:
-        skus.append({"sku": "ANL-ADV-02", "item": "Advanced Analytics", "price": add_on_price})
-
-    subtotal = sum(x["price"] for x in skus)
-
     discount_pct = float(asset_row["last_discount_pct"])
-    discount_amt = round(subtotal * discount_pct / 100.0, 2)
-    total = round(subtotal - discount_amt, 2)
-    # --- Service level upgrade logic (renewal upsell) ---
-    # --- Service level logic (explicit & safe) ---
-    expansion_type = asset_row.get("upsell_cross_sell", "Renewal Only")
+    skus, skus_md, subtotal, discount_amt, total, service_level = price_quote(
+        float(asset_row["contract_value"]),
+        str(asset_row.get("upsell_cross_sell", "Renewal Only")),
+        discount_pct,
+    )
 
-    if expansion_type == "Upsell":
-        service_level = "ProSupport Plus"
-    else:
-        service_level = "ProSupport"
-
-    return {
-        "quote_id": quote_id,
-        "version": version,
-        "parent_quote_id": parent_quote_id,
-        "asset_id": asset_row["asset_id"],
-        "customer": asset_row["customer"],
-        "created_at": pd.Timestamp.now(),
-        "status": "PENDING",
-        "pricing": {
-            "skus": skus,
-            "subtotal": subtotal,
-            "discount_pct": discount_pct,
-            "discount_amt": discount_amt,
-            "discount_reason": discount_reason,
-            "discount_source": discount_source,
-            "total": total,
-            "discount_change": {
-                "previous": previous_discount,
-                "current": discount_pct
-            },
+    created_at = pd.Timestamp.now()
+
+    return Quote(
+        quote_id=quote_id,
+        version=version,
+        parent_quote_id=parent_quote_id,
+        asset_id=asset_row["asset_id"],
+        customer=asset_row["customer"],
+        created_at=created_at,
+        created_at_str=created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        pricing=Pricing(
+            skus=skus,
+            skus_md=skus_md,
+            subtotal=subtotal,
+            discount_pct=discount_pct,
+            discount_amt=discount_amt,
+            discount_reason=discount_reason,
+            discount_source=discount_source,
+            total=total,
+            discount_change=DiscountChange(previous=previous_discount, current=discount_pct),
+        ),
+        contract=Contract(
+            start=today,
+            end=today + timedelta(days=365),
+            service_level=service_level,
+        ),
+    )
 
-        },
-        "contract": {
-                "start": pd.Timestamp.today().normalize(),
-                "end": pd.Timestamp.today().normalize() + timedelta(days=365),
-                "service_level": service_level,
-        },
-        "decision": None,
-        "approval": {
-            "required": False,
-            "approved": False,
-            "approved_at": None,
-        }
-    }
+def store_quote(q: Quote):
+    # Single insertion point so quotes and the asset_id -> [quote_id] index never drift apart;
+    # ids are appended in version order, so the last one per asset is the latest
+    st.session_state.quotes[q.quote_id] = q
+    st.session_state.quotes_by_asset.setdefault(q.asset_id, []).append(q.quote_id)
+
+# Keyword intent matcher, checked in order; the LLM is only a fallback for reasons none of these match
+INTENT_PATTERNS = [
+    # "pric" is matched as a bare stem (price, pricing, overpriced, pricey), keeping every reason the
+    # original `"price" in reason` check routed to a revised quote
+    ("price", re.compile(r"pric|\b(costs?|costly|expensive|cheaper|discounts?)\b", re.I)),
+    ("hardware_change", re.compile(r"\b(hardware|refresh|replac(e|ing)|upgrades?)\b", re.I)),
+    ("timing", re.compile(r"\b(later|next quarter|budgets?|timing|delay(ed)?)\b", re.I)),
+]
+
+def classify_intent(reason_text: str) -> str:
+    for name, pattern in INTENT_PATTERNS:
+        if pattern.search(reason_text):
+            return name
+    return "unclear"
 
 def negotiation_agent(asset_row, rejection_reason: str, use_llm_flag: bool):
-    priority = asset_row["opportunity_priority"]
-    base_discount = float(asset_row["last_discount_pct"])
-    max_discount = float(NEGOTIATION_GUARDRAILS[priority]["max_discount"])
+    intent = classify_intent(rejection_reason)
+    if intent == "unclear" and use_llm_flag:
+        intent = llm_negotiate(rejection_reason)
 
-    intent = llm_negotiate(rejection_reason) if use_llm_flag else "price" if "price" in rejection_reason.lower() else "unclear"
+    return _negotiation_decision(str(asset_row["opportunity_priority"]), float(asset_row["last_discount_pct"]), intent)
+
+def _negotiation_decision(priority: str, base_discount: float, intent: str) -> dict:
+    # Rule path only, on plain values; a few comparisons, so it is cheaper to run than any cache lookup
+    max_discount = float(NEGOTIATION_GUARDRAILS[priority]["max_discount"])
 
     if intent == "price":
         new_discount = min(base_discount + 5, max_discount)
@@ -556,32 +620,114 @@ def negotiation_agent(asset_row, rejection_reason: str, use_llm_flag: bool):
 # =========================
 # DASHBOARD
 # =========================
+# Static asset-details card markup, filled per selected row with str.format
+_DETAIL_HTML = """
+<div style="
+    padding:12px 16px;
+    border-left:3px solid #e5e7eb;
+    background:#fafafa;
+    border-radius:6px;
+">
+<b>Asset ID:</b> {asset_id} &nbsp; | &nbsp;
+<b>Product:</b> {product} &nbsp; | &nbsp;
+<b>Customer Type:</b> {customer_type}<br><br>
+<b>Current Support Level:</b> {service_level_current}<br>
+{upgrade}
+
+
+<b>Contract:</b> {contract} ({start} → {end})<br>
+<b>Days to expiry:</b> {days} days<br><br>
+
+<b>Usage:</b> {usage} &nbsp; | &nbsp;
+<b>Usage decline:</b> {usage_decline}<br>
+<b>Asset age:</b> {asset_age} years<br>
+<b>Licensing:</b> {licensing}<br>
+<b>Last discount:</b> {last_discount}% {breach}<br>
+</div>
+"""
+_BREACH_HTML = "<span style='color:#b91c1c; font-weight:700;'>(Guardrail breach)</span>"
+
+def detail_card_html(r) -> str:
+    guardrail_breach = check_discount_guardrail(r["opportunity_priority"], r["last_discount_pct"])
+    upgrade = (
+        "<b>Recommended Upgrade:</b> " + r.get("service_level_upgrade", "ProSupport Plus") + "<br><br>"
+        if r["upsell_cross_sell"] == "Upsell" else "<br>"
+    )
+    return _DETAIL_HTML.format(
+        asset_id=r["asset_id"],
+        product=r["product"],
+        customer_type=r["customer_type"],
+        service_level_current=r.get("service_level_current", "ProSupport"),
+        upgrade=upgrade,
+        contract=money(r["contract_value"]),
+        start=r["contract_start_date"],
+        end=r["contract_end_date"],
+        days=int(r["days_to_expiry"]),
+        usage=pct(r["usage_pct"]),
+        usage_decline=pct(r["usage_decline_pct"]),
+        asset_age=r["asset_age_years"],
+        licensing=r["licensing"],
+        last_discount=int(r["last_discount_pct"]),
+        breach=_BREACH_HTML if guardrail_breach else "",
+    )
+
+def filter_agent_df() -> tuple[pd.DataFrame, tuple[int, int, int], float]:
+    # Most reruns leave the filters alone, so the last slice and its KPI aggregates are reused until
+    # a filter or agent_df itself changes (every agent_df write bumps agent_df_version)
+    key = (
+        st.session_state.agent_df_version,
+        tuple(customer_types_filter),
+        tuple(product_filter),
+        tuple(priority_filter),
+        max_days_filter,
+    )
+    cached = st.session_state.filtered_view
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    # Apply global filters (widgets created once in sidebar); the mask read is already a new frame, no copy needed
+    agent_df = st.session_state.agent_df
+    mask = np.logical_and.reduce([
+        agent_df["customer_type"].isin(customer_types_filter).to_numpy(),
+        agent_df["product"].isin(product_filter).to_numpy(),
+        agent_df["opportunity_priority"].isin(priority_filter).to_numpy(),
+        agent_df["days_to_expiry"].to_numpy() <= max_days_filter,
+    ])
+    df = agent_df.loc[mask]
+
+    # (High, Medium, Low) counts and the raw impact sum; the portfolio multiplier is applied by the caller
+    if df.empty:
+        counts, impact = (0, 0, 0), 0.0
+    else:
+        counts = tuple(
+            int(n) for n in df["opportunity_priority"].value_counts().reindex(["High", "Medium", "Low"], fill_value=0)
+        )
+        impact = float(df["expected_revenue_impact"].to_numpy().sum())
+
+    view = (df, counts, impact)
+    st.session_state.filtered_view = (key, view)
+    # New rows under the same positions: the worklist widget key changes so the old row selection is dropped
+    st.session_state.worklist_gen += 1
+    return view
+
 def render_dashboard():
     st.title("Renewal Opportunities Dashboard")
     st.caption("Enterprise renewal cockpit that surfaces what matters, with guardrails, explainability, and quote actions.")
 
-    df_base = load_assets()
+    df_base = load_assets(TODAY)
 
     if st.session_state.agent_df is None or run_agents_clicked:
         with st.spinner("🤖 Agents are analyzing renewals…"):
-            st.session_state.agent_df = run_agents(df_base, use_llm)
-
-    df = st.session_state.agent_df.copy()
+            st.session_state.agent_df = run_agents_cached(df_base)
+        # asset_id -> row position, so single-asset writes don't scan the frame
+        asset_ids = st.session_state.agent_df["asset_id"]
+        st.session_state.asset_pos = dict(zip(asset_ids, range(len(asset_ids))))
+        st.session_state.agent_df_version += 1
 
-    # Apply global filters (widgets created once in sidebar)
-    df = df[
-        (df["customer_type"].isin(customer_types_filter)) &
-        (df["product"].isin(product_filter)) &
-        (df["opportunity_priority"].isin(priority_filter)) &
-        (df["days_to_expiry"] <= max_days_filter)
-    ].copy()
+    df, (high_ct, med_ct, low_ct), impact = filter_agent_df()
 
-    # KPI row (includes accept/reject KPIs)
-    total_impact = float(df["expected_revenue_impact"].sum()) * float(portfolio_multiplier) if not df.empty else 0.0
-
-    high_ct = int((df["opportunity_priority"] == "High").sum()) if not df.empty else 0
-    med_ct = int((df["opportunity_priority"] == "Medium").sum()) if not df.empty else 0
-    low_ct = int((df["opportunity_priority"] == "Low").sum()) if not df.empty else 0
+    # KPI row (includes accept/reject KPIs); counts and impact come with the cached filtered view
+    total_impact = impact * float(portfolio_multiplier)
 
     accept_ct = int(st.session_state.accept_count)
     reject_ct = int(st.session_state.reject_count)
@@ -603,94 +749,69 @@ def render_dashboard():
         st.warning("No records match your filters.")
         return
 
-    # Worklist table (restored layout)
-    st.subheader("Today’s worklist")
-
-    headers = ["", "Asset", "Customer", "Priority", "Status", "Expansion", "P2C", "Impact", "Action"]
-    colw = [0.6, 1.2, 2.0, 1.2, 1.3, 1.4, 1.3, 1.4, 1.4]
-
-    hcols = st.columns(colw)
-    for i, h in enumerate(headers):
-        hcols[i].markdown(f"**{h}**")
-
-    for _, r in df.iterrows():
-        asset_id = r["asset_id"]
-        is_expanded = asset_id in st.session_state.expanded_rows
-
-        rowcols = st.columns(colw)
-
-        arrow = "▼" if is_expanded else "▶"
-        if rowcols[0].button(arrow, key=f"expand_{asset_id}"):
-            if is_expanded:
-                st.session_state.expanded_rows.remove(asset_id)
-            else:
-                st.session_state.expanded_rows.add(asset_id)
-            st.rerun()
-
-        rowcols[1].markdown(f"**{r['asset_id']}**")
-        rowcols[2].write(r["customer"])
-        rowcols[3].markdown(priority_badge(r["opportunity_priority"]))
-        rowcols[4].markdown(status_badge(r["opportunity_status"]))
-        rowcols[5].write(r["upsell_cross_sell"])
-        rowcols[6].markdown(f"**{int(r['probability_to_close'])}% — {p2c_badge(int(r['probability_to_close']))}**")
-        rowcols[7].write(money(r["expected_revenue_impact"]))
-
-        action_label = "Generate Quote" if r["opportunity_priority"] in ["High", "Medium"] else "Review"
-        if rowcols[8].button(action_label, key=f"quote_{asset_id}"):
-            # create or pick latest quote
-            existing = [q for q in st.session_state.quotes.values() if q["asset_id"] == r["asset_id"]]
-            if not existing:
-                q = build_quote(r, version=1)
-                st.session_state.quotes[q["quote_id"]] = q
-                st.session_state.current_quote_id = q["quote_id"]
-            else:
-                latest = max(existing, key=lambda x: x["version"])
-                st.session_state.current_quote_id = latest["quote_id"]
-
-            st.session_state.selected_asset = r
-            st.session_state.show_email_block = True
-            st.session_state.quote_entry_mode = "initial"
-            st.session_state.page = "quote"
-            st.rerun()
-
-        # Expanded details card (restored)
-        if is_expanded:
-            contract_start = pd.to_datetime(r["contract_start"]).date()
-            contract_end = pd.to_datetime(r["contract_end"]).date()
-            guardrail_breach = check_discount_guardrail(r["opportunity_priority"], r["last_discount_pct"])
+    render_worklist(df)
 
-            st.markdown(
-                f"""
-                <div style="
-                    margin-left:38px;
-                    padding:12px 16px;
-                    border-left:3px solid #e5e7eb;
-                    background:#fafafa;
-                    border-radius:6px;
-                ">
-                <b>Asset ID:</b> {r["asset_id"]} &nbsp; | &nbsp;
-                <b>Product:</b> {r["product"]} &nbsp; | &nbsp;
-                <b>Customer Type:</b> {r["customer_type"]}<br><br>
-                <b>Current Support Level:</b> {r.get("service_level_current", "ProSupport")}<br>
-                {"<b>Recommended Upgrade:</b> " + r.get("service_level_upgrade", "ProSupport Plus") + "<br><br>"
-                if r["upsell_cross_sell"] == "Upsell" else "<br>"}
+@st.fragment
+def render_worklist(df: pd.DataFrame):
+    # Fragment: row selection reruns only the worklist + details card, not loading/scoring/KPIs
+    # Worklist table: one selectable dataframe instead of a widget row per asset
+    st.subheader("Today’s worklist")
 
+    # Badges come precomputed from run_agents; numbers are formatted client-side and sort numerically
+    worklist = df[[
+        "asset_id", "customer", "_prio_badge", "_status_badge", "upsell_cross_sell",
+        "probability_to_close", "expected_revenue_impact",
+    ]].set_axis(["Asset", "Customer", "Priority", "Status", "Expansion", "P2C", "Impact"], axis=1)
+    event = st.dataframe(
+        worklist,
+        hide_index=True,
+        column_config={
+            "P2C": st.column_config.ProgressColumn(format="%d%%", min_value=0, max_value=100),
+            "Impact": st.column_config.NumberColumn(format="dollar"),
+        },
+        on_select="rerun",
+        selection_mode="single-row",
+        key=f"worklist_{st.session_state.worklist_gen}",
+    )
 
-                <b>Contract:</b> {money(r["contract_value"])} ({contract_start} → {contract_end})<br>
-                <b>Days to expiry:</b> {int(r["days_to_expiry"])} days<br><br>
+    # Positions always refer to this df: any filter/data change re-keys the widget (worklist_gen)
+    selected = event.selection.rows
+    if not selected:
+        st.caption("Select a row to see asset details and quote actions.")
+        return
 
-                <b>Usage:</b> {pct(r["usage_pct"])} &nbsp; | &nbsp;
-                <b>Usage decline:</b> {pct(r["usage_decline_pct"])}<br>
-                <b>Asset age:</b> {r["asset_age_years"]} years<br>
-                <b>Licensing:</b> {r["licensing"]}<br>
-                <b>Last discount:</b> {int(r["last_discount_pct"])}% {"<span style='color:#b91c1c; font-weight:700;'>(Guardrail breach)</span>" if guardrail_breach else ""}<br><br>
+    # Plain dict row (no per-row Series); quote/reject pages keep the same dict-style access
+    r = df.iloc[selected].to_dict("records")[0]
+    asset_id = r["asset_id"]
+
+    # Selected asset details card (restored)
+    with st.expander(f"Asset details — {asset_id}", expanded=True):
+        # Card HTML is kept per asset and rebuilt only after agent_df changes (rescoring or a new discount)
+        version = st.session_state.agent_df_version
+        cached = st.session_state.card_html.get(asset_id)
+        if cached is None or cached[0] != version:
+            cached = st.session_state.card_html[asset_id] = (version, detail_card_html(r))
+        st.markdown(cached[1], unsafe_allow_html=True)
+
+        st.markdown("**Agent explanation:**")
+        render_explanation(r)
+
+    if st.button(r["_action_label"], key=r["_quote_key"], type="primary"):
+        # create or pick latest quote
+        existing = st.session_state.quotes_by_asset.get(asset_id, [])
+        if not existing:
+            q = build_quote(r, version=1, today=TODAY)
+            store_quote(q)
+            st.session_state.current_quote_id = q.quote_id
+        else:
+            # ids are appended in version order, so the last one is the latest
+            st.session_state.current_quote_id = existing[-1]
 
-                <b>Agent explanation:</b><br>
-                {r["llm_explanation"] if use_llm else "Rule-based decision. Enable LLM for explanation."}
-                </div>
-                """,
-                unsafe_allow_html=True,
-            )
+        st.session_state.selected_asset = r
+        st.session_state.show_email_block = True
+        st.session_state.quote_entry_mode = "initial"
+        st.session_state.page = "quote"
+        st.rerun()
 
 # =========================
 # QUOTE PAGE (RESTORED FLOW)
@@ -748,11 +869,11 @@ def render_quote():
 
     if st.session_state.quote_entry_mode == "regenerated":
         st.success("✨ Here is a new quote for you. Hope you will like the new offer.")
-        change = quote["pricing"].get("discount_change")
-        if change and change["previous"] is not None:
+        change = quote.pricing.discount_change
+        if change.previous is not None:
             st.info(
                 f"💰 Discount updated: "
-                f"{change['previous']:.0f}% → {change['current']:.0f}%"
+                f"{change.previous:.0f}% → {change.current:.0f}%"
             )
 
     if st.button("← Back to Dashboard"):
@@ -770,22 +891,21 @@ def render_quote():
 
     st.divider()
 
-    # Quote history timeline (restored)
-    with st.expander("Quote history timeline"):
-        history = [q for q in st.session_state.quotes.values() if q["asset_id"] == r["asset_id"]]
-        history = sorted(history, key=lambda x: x["version"])
+    # Quote history timeline (restored); a toggle instead of an expander, whose body runs even when collapsed
+    if st.toggle("Quote history timeline", key="timeline_open"):
+        history = [st.session_state.quotes[qid] for qid in st.session_state.quotes_by_asset.get(r["asset_id"], [])]
 
         for q in history:
-            pricing = q["pricing"]
-            breach = check_discount_guardrail(r["opportunity_priority"], pricing["discount_pct"])
-            title = f"v{q['version']} — {q['status']} | {pricing['discount_pct']}% discount | Total: {money(pricing['total'])}"
+            pricing = q.pricing
+            breach = check_discount_guardrail(r["opportunity_priority"], pricing.discount_pct)
+            title = f"v{q.version} — {q.status} | {pricing.discount_pct}% discount | Total: {money(pricing.total)}"
             st.markdown(f"**{title}**")
-            st.caption(f"Created: {pd.to_datetime(q['created_at']).strftime('%Y-%m-%d %H:%M:%S')}")
-            st.caption(f"Reason: {pricing.get('discount_reason', '—')} (Source: {pricing.get('discount_source', 'system')})")
+            st.caption(f"Created: {q.created_at_str}")
+            st.caption(f"Reason: {pricing.discount_reason} (Source: {pricing.discount_source})")
             if breach:
                 st.warning(f"⚠️ Guardrail breach (max {NEGOTIATION_GUARDRAILS[r['opportunity_priority']]['max_discount']}%). Approval required.")
-            if q.get("decision"):
-                st.info(f"Decision: {q['decision']['decision']} — {q['decision']['reason']}")
+            if q.decision:
+                st.info(f"Decision: {q.decision.decision} — {q.decision.reason}")
 
             st.divider()
 
@@ -795,15 +915,14 @@ def render_quote():
     with left:
         st.subheader("Service & pricing")
 
-        pricing = quote["pricing"]
-        skus = pricing["skus"]
-        st.table(pd.DataFrame(skus))
+        pricing = quote.pricing
+        st.markdown(pricing.skus_md)
 
         p1, p2, p3 = st.columns(3)
-        p1.metric("Subtotal", money(pricing["subtotal"]))
-        p2.metric("Discount", f"{pricing['discount_pct']:.0f}% ({money(pricing['discount_amt'])})")
-        change = pricing.get("discount_change")
-        if change and change["previous"] is not None:
+        p1.metric("Subtotal", money(pricing.subtotal))
+        p2.metric("Discount", f"{pricing.discount_pct:.0f}% ({money(pricing.discount_amt)})")
+        change = pricing.discount_change
+        if change.previous is not None:
             st.markdown(
                 f"""
                 <div style="
@@ -813,62 +932,62 @@ def render_quote():
                     font-size:14px;
                 ">
                 <b>Discount change:</b>
-                {change['previous']:.0f}% → <b>{change['current']:.0f}%</b>
+                {change.previous:.0f}% → <b>{change.current:.0f}%</b>
                 </div>
                 """,
                 unsafe_allow_html=True,
             )
 
-        p3.metric("Total", money(pricing["total"]))
+        p3.metric("Total", money(pricing.total))
 
         st.caption("Discount guardrails applied by priority; breaches require approval.")
 
     with right:
         st.subheader("Contract")
         st.write({
-            "Service level": quote["contract"]["service_level"],
-            "Start": str(pd.to_datetime(quote["contract"]["start"]).date()),
-            "End": str(pd.to_datetime(quote["contract"]["end"]).date()),
+            "Service level": quote.contract.service_level,
+            "Start": str(quote.contract.start.date()),
+            "End": str(quote.contract.end.date()),
         })
 
         with st.expander("Why this quote? (Explainability)"):
-            st.write(r["llm_explanation"] if use_llm else "Rule-based decision. Enable LLM for explanation.")
+            render_explanation(r)
 
     st.divider()
 
     # Guardrail breach approval flow (restored)
     priority = r["opportunity_priority"]
-    discount_pct = float(quote["pricing"]["discount_pct"])
+    discount_pct = float(quote.pricing.discount_pct)
     breach = check_discount_guardrail(priority, discount_pct)
 
     if breach:
-        quote["approval"]["required"] = True
+        quote.approval.required = True
         st.warning(
             f"⚠️ Approval required: discount {discount_pct:.0f}% exceeds {NEGOTIATION_GUARDRAILS[priority]['max_discount']}% max for {priority} priority."
         )
         approved = st.checkbox(
             "I approve this exception (mock approval)",
-            value=quote["approval"].get("approved", False),
-            key=f"approve_{quote['quote_id']}"
+            value=quote.approval.approved,
+            key=f"approve_{quote.quote_id}"
         )
-        if approved and not quote["approval"]["approved"]:
-            quote["approval"]["approved"] = True
-            quote["approval"]["approved_at"] = pd.Timestamp.now()
+        if approved and not quote.approval.approved:
+            quote.approval.approved = True
+            quote.approval.approved_at = pd.Timestamp.now()
             st.session_state.approval_count += 1
             st.success("✅ Exception approved (mock). You can proceed to accept.")
     else:
-        quote["approval"]["required"] = False
-        quote["approval"]["approved"] = True  # no approval needed
+        quote.approval.required = False
+        quote.approval.approved = True  # no approval needed
 
     # Decision actions (Accept / Reject)
     st.subheader("Decision")
     a, b = st.columns([1, 1])
 
-    can_accept = (not breach) or (breach and quote["approval"]["approved"])
+    can_accept = (not breach) or (breach and quote.approval.approved)
 
     if a.button("✅ Accept Quote", type="primary", disabled=not can_accept):
-        quote["status"] = "ACCEPTED"
-        quote["decision"] = {"decision": "ACCEPTED", "reason": "Customer accepted", "timestamp": pd.Timestamp.now()}
+        quote.status = "ACCEPTED"
+        quote.decision = Decision(decision="ACCEPTED", reason="Customer accepted", timestamp=pd.Timestamp.now())
         st.session_state.accept_count += 1
         st.success("Quote accepted. (Mock order placed / email sent)")
         st.session_state.page = "dashboard"
@@ -909,38 +1028,29 @@ def render_reject():
         "Rejection reason",
         placeholder="Example: Price too high. We are reviewing budgets for next quarter.",
         height=120,
-        key=f"reject_reason_{current_quote['quote_id']}"
+        key=f"reject_reason_{current_quote.quote_id}"
     )
 
     if st.button("Submit and get recommendation", type="primary"):
-        # -----------------------------
-        # Simulate agent processing delay
-        # -----------------------------
-        with st.spinner("🤖 Our agents are analyzing pricing, usage, and guardrails…"):
-            time.sleep(4)
-
-        with st.spinner("🧠 Optimizing the best possible offer for you…"):
-            time.sleep(3)
-
         # mark rejected
-        current_quote["status"] = "REJECTED"
-        current_quote["decision"] = {
-            "decision": "REJECTED",
-            "reason": reason,
-            "timestamp": pd.Timestamp.now()
-        }
+        current_quote.status = "REJECTED"
+        current_quote.decision = Decision(decision="REJECTED", reason=reason, timestamp=pd.Timestamp.now())
         st.session_state.reject_count += 1
 
-        decision = negotiation_agent(r, reason, use_llm)
-        # If discount guardrail is breached, delay response
+        # Status shows only while the agent actually works (keyword rules are instant; the LLM fallback is not)
+        with st.status("🤖 Our agents are analyzing pricing, usage, and guardrails…") as status:
+            decision = negotiation_agent(r, reason, use_llm)
+            status.update(label="🧠 Best possible offer ready", state="complete")
+
+        # If discount guardrail is breached, defer the response
         guardrail_breached = check_discount_guardrail(
             r["opportunity_priority"],
             r["last_discount_pct"]
         )
 
         if guardrail_breached:
-            st.info("🕒 Thank you for your patience. We will be back with a new offer in 2–3 business days.")
-            time.sleep(2)
+            # Toast outlives the rerun, so the message stays visible without holding the script thread
+            st.toast("🕒 Thank you for your patience. We will be back with a new offer in 2–3 business days.")
             st.session_state.page = "dashboard"
             st.rerun()
 
@@ -950,10 +1060,10 @@ def render_reject():
 
         if decision["action"] == "new_quote":
             prev = current_quote
-            new_version = int(prev["version"]) + 1
+            new_version = int(prev.version) + 1
 
             # Update asset discount before building new quote (MVP behavior)
-            previous_discount = float(current_quote["pricing"]["discount_pct"])
+            previous_discount = float(current_quote.pricing.discount_pct)
             new_discount = float(decision["new_discount"])
 
 
@@ -961,20 +1071,23 @@ def render_reject():
             updated_asset = dict(r)
             updated_asset["last_discount_pct"] = new_discount
 
-            mask = st.session_state.agent_df["asset_id"] == updated_asset["asset_id"]
-            st.session_state.agent_df.loc[mask, "last_discount_pct"] = new_discount
+            agent_df = st.session_state.agent_df
+            pos = st.session_state.asset_pos[updated_asset["asset_id"]]
+            agent_df.iat[pos, agent_df.columns.get_loc("last_discount_pct")] = new_discount
+            st.session_state.agent_df_version += 1
 
             new_quote = build_quote(
                 updated_asset,
                 version=new_version,
-                parent_quote_id=prev["quote_id"],
+                parent_quote_id=prev.quote_id,
                 discount_reason=f"Customer rejected due to price: {reason[:120]}",
                 discount_source="negotiation_agent",
-                previous_discount=previous_discount
+                previous_discount=previous_discount,
+                today=TODAY,
             )
 
-            st.session_state.quotes[new_quote["quote_id"]] = new_quote
-            st.session_state.current_quote_id = new_quote["quote_id"]
+            store_quote(new_quote)
+            st.session_state.current_quote_id = new_quote.quote_id
             st.session_state.selected_asset = updated_asset
 
             st.success(f"New quote version v{new_version} created with {decision['new_discount']:.0f}% discount")